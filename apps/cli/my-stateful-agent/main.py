@@ -2,17 +2,42 @@
 Agentiom Agent: my-stateful-agent
 
 A stateful agent that remembers data across sleep/wake cycles.
-State is persisted to /data/state.json on the attached volume.
+State is persisted on the attached volume, by default to a SQLite database
+at /data/state.db (set AGENTIOM_STATE_BACKEND=json for the legacy
+log + snapshot files next to /data/state.json).
 """
 
+import io
 import os
 import json
 import logging
+import mmap
 import signal
+import sqlite3
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
 
+# Optional: orjson for faster state (de)serialization (stdlib json fallback)
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, default=str)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), default=str).encode()
+
+    def _loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
 logging.basicConfig(
     level=os.getenv('LOG_LEVEL', 'INFO'),
     format='%(asctime)s [%(levelname)s] %(message)s'
@@ -22,64 +47,370 @@ logger = logging.getLogger(__name__)
 AGENT_NAME = os.getenv('AGENTIOM_AGENT_NAME', os.getenv('AGENT_NAME', 'my-stateful-agent'))
 PORT = int(os.getenv('PORT', '8080'))
 STATE_PATH = Path(os.getenv('AGENTIOM_STATE_PATH', '/data')) / 'state.json'
+STATE_BACKEND = os.getenv('AGENTIOM_STATE_BACKEND', 'sqlite')
+
+
+# /health is probed constantly; pre-encode everything but the state_keys count
+HEALTH_PREFIX = (
+    '{"status":"healthy","agent":%s,"state_keys":' % json.dumps(AGENT_NAME)
+).encode()
+
+# Keys holding bounded lists (exact key or prefix) and their max lengths
+BOUNDED_LISTS = {'messages': 100}
+
 
+def _maxlen_for(key):
+    for prefix, maxlen in BOUNDED_LISTS.items():
+        if key.startswith(prefix):
+            return maxlen
+    return None
 
-class StateManager:
-    """Persistent state that survives sleep/wake cycles."""
+# Snapshot the full state after this many logged mutations
+SNAPSHOT_EVERY = 200
+
+# Hint the kernel to start log writeback after this many appended bytes,
+# so dirty pages drain incrementally instead of in one giant flush
+SYNC_RANGE_BYTES = 256 * 1024
+
+
+class JsonStateManager:
+    """Persistent state in a JSON snapshot plus append-only mutation log.
+
+    Mutations are appended to a JSONL log next to the snapshot file, so each
+    write is O(change) instead of rewriting the whole state. The full state is
+    snapshotted every SNAPSHOT_EVERY mutations and on shutdown, after which
+    the log is truncated. On startup the snapshot is loaded and the log
+    replayed, so nothing is lost between snapshots. Log entries carry a
+    sequence number that the snapshot records, so entries a snapshot already
+    folded in are never re-applied (appends are not idempotent).
+    """
 
     def __init__(self, path: Path):
         self.path = path
+        self.log_path = path.with_suffix('.log')
+        self._lock = threading.RLock()
         self.data = {}
+        self._mutations = 0
+        self._seq = 0
+        self._bytes_since_sync = 0
+        self._dirty = False
         self.load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._log = open(self.log_path, 'ab', buffering=0)
 
     def load(self):
-        """Load state from disk."""
+        """Load the last snapshot, then replay any logged mutations."""
         try:
-            if self.path.exists():
-                with open(self.path) as f:
-                    self.data = json.load(f)
+            if self.path.exists() and self.path.stat().st_size:
+                # Map the file and hand the whole buffer to the one-shot
+                # parser: no text decode, no 8 KB incremental reads
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    mv = memoryview(mm)
+                    try:
+                        self.data = _loads(mv)
+                    finally:
+                        mv.release()
+                        mm.close()
                 logger.info(f"Loaded state ({len(self.data)} keys)")
             else:
                 logger.info("No existing state, starting fresh")
         except Exception as e:
             logger.error(f"Failed to load state: {e}")
             self.data = {}
+        self._seq = self.data.pop('__seq__', 0)
+        self._replay_log()
+        for key, value in self.data.items():
+            maxlen = _maxlen_for(key)
+            if maxlen and isinstance(value, list):
+                self.data[key] = deque(value, maxlen=maxlen)
+
+    def _replay_log(self):
+        """Apply mutations logged since the last snapshot.
+
+        A crash mid-append leaves a torn final line; that tail is cut off so
+        the log ends on a clean line before it is reopened for appending.
+        """
+        if not self.log_path.exists():
+            return
+        replayed = 0
+        valid_bytes = 0
+        torn = False
+        try:
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        torn = True  # partial final line from a crash mid-append
+                        break
+                    stripped = line.strip()
+                    if stripped:
+                        try:
+                            entry = _loads(stripped)
+                        except ValueError:
+                            torn = True
+                            break
+                        seq = entry.get('s', 0)
+                        # entries at or below the snapshot's sequence number
+                        # are already folded in (crash after the rename but
+                        # before the log truncate); don't re-apply them
+                        if not seq or seq > self._seq:
+                            self._apply(entry)
+                            self._seq = max(self._seq, seq)
+                            replayed += 1
+                    valid_bytes += len(line)
+            if torn:
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(valid_bytes)
+                logger.warning(f"Dropped torn state log tail after {valid_bytes} bytes")
+        except Exception as e:
+            logger.error(f"Failed to replay state log: {e}")
+        if replayed:
+            logger.info(f"Replayed {replayed} logged mutations")
+
+    def _apply(self, entry):
+        if entry.get('op') == 'append':
+            items = self.data.get(entry['k'], [])
+            items.append(entry['v'])
+            if not isinstance(items, deque):
+                self.data[entry['k']] = items[-entry.get('max', 100):]
+        else:
+            self.data[entry['k']] = entry['v']
+
+    def _log_mutation(self, entry):
+        self._seq += 1
+        entry['s'] = self._seq
+        try:
+            line = _dumps(entry) + b'\n'
+            self._log.write(line)
+            self._bytes_since_sync += len(line)
+            if (self._bytes_since_sync >= SYNC_RANGE_BYTES
+                    and hasattr(os, 'sync_file_range')):
+                # Non-blocking writeback hint; the snapshot's durable write
+                # remains the only real barrier
+                self._log.flush()
+                os.sync_file_range(
+                    self._log.fileno(), 0, 0, os.SYNC_FILE_RANGE_WRITE
+                )
+                self._bytes_since_sync = 0
+        except Exception as e:
+            logger.error(f"Failed to append to state log: {e}")
+        self._dirty = True
+        self._mutations += 1
+        if self._mutations >= SNAPSHOT_EVERY:
+            self.snapshot()
 
     def save(self):
-        """Save state to disk."""
+        """No-op between snapshots: every mutation is already on disk in the log."""
+
+    def snapshot(self):
+        """Atomically write the full state to disk and truncate the mutation log.
+
+        Does nothing if no mutation happened since the last snapshot, so clean
+        shutdowns and idle timers cost no fsync. The write goes to a tmp file
+        that is fsynced and renamed over the snapshot, then the directory is
+        fsynced, so a crash at any point leaves a complete snapshot behind.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix('.tmp')
+                snap = {
+                    k: list(v) if isinstance(v, deque) else v
+                    for k, v in self.data.items()
+                }
+                snap['__seq__'] = self._seq
+                buf = _dumps(snap)
+                if hasattr(os, 'O_DSYNC'):
+                    # O_DSYNC makes write + fdatasync a single submitted operation
+                    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DSYNC, 0o644)
+                    try:
+                        os.write(fd, buf)
+                    finally:
+                        os.close(fd)
+                else:
+                    with open(tmp, 'wb', buffering=65536) as f:
+                        f.write(buf)
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                dfd = os.open(self.path.parent, os.O_DIRECTORY)
+                try:
+                    os.fsync(dfd)
+                finally:
+                    os.close(dfd)
+                self._log.truncate(0)
+                self._mutations = 0
+                self._bytes_since_sync = 0
+                self._dirty = False
+                logger.info("State snapshot saved")
+            except Exception as e:
+                logger.error(f"Failed to save state: {e}")
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self.data[key] = value
+            self._log_mutation({'k': key, 'v': value})
+
+    def increment(self, key, by=1):
+        with self._lock:
+            self.data[key] = self.get(key, 0) + by
+            self._log_mutation({'k': key, 'v': self.data[key]})
+            return self.data[key]
+
+    def append_to_list(self, key, value, max_items=100):
+        """Append to a bounded list in state; old items fall off the front."""
+        with self._lock:
+            items = self.data.get(key)
+            if not isinstance(items, deque):
+                items = deque(items or [], maxlen=_maxlen_for(key) or max_items)
+                self.data[key] = items
+            items.append(value)
+            self._log_mutation({'op': 'append', 'k': key, 'v': value, 'max': max_items})
+            return items
+
+
+class SqliteStateManager:
+    """Persistent state backed by SQLite in WAL mode.
+
+    Each key is one row (key -> JSON blob), so an update writes only the
+    changed row and the WAL amortizes durability instead of an fsync per
+    write. Reads come from an in-memory mirror hydrated by a single table
+    scan at startup. A legacy state.json (and its mutation log) is migrated
+    into the database on first run.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db_path = path.with_suffix('.db')
+        self._lock = threading.RLock()
+        self.data = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v BLOB)')
+        self.load()
+
+    def load(self):
+        """Hydrate the in-memory mirror, migrating legacy JSON state if present."""
+        rows = self._conn.execute('SELECT k, v FROM kv').fetchall()
+        if rows:
+            self.data = {k: _loads(v) for k, v in rows}
+            logger.info(f"Loaded state ({len(self.data)} keys)")
+        elif self.path.exists() or self.path.with_suffix('.log').exists():
+            legacy = JsonStateManager(self.path)
+            for key, value in legacy.data.items():
+                self.data[key] = value
+                self._put(key)
+            logger.info(f"Migrated {len(self.data)} keys from {self.path}")
+        else:
+            logger.info("No existing state, starting fresh")
+        for key, value in self.data.items():
+            maxlen = _maxlen_for(key)
+            if maxlen and isinstance(value, list):
+                self.data[key] = deque(value, maxlen=maxlen)
+
+    def _put(self, key):
+        value = self.data[key]
+        if isinstance(value, deque):
+            value = list(value)
         try:
-            self.path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.path, 'w') as f:
-                json.dump(self.data, f, indent=2, default=str)
-            logger.info("State saved")
+            self._conn.execute(
+                'INSERT OR REPLACE INTO kv VALUES (?, ?)', (key, _dumps(value))
+            )
         except Exception as e:
-            logger.error(f"Failed to save state: {e}")
+            logger.error(f"Failed to write state key {key}: {e}")
+
+    def save(self):
+        """No-op: each upsert is already committed via the WAL."""
+
+    def snapshot(self):
+        """Checkpoint the WAL so the main database is self-contained."""
+        with self._lock:
+            try:
+                self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except Exception as e:
+                logger.error(f"Failed to checkpoint state database: {e}")
 
     def get(self, key, default=None):
         return self.data.get(key, default)
 
     def set(self, key, value):
-        self.data[key] = value
+        with self._lock:
+            self.data[key] = value
+            self._put(key)
 
     def increment(self, key, by=1):
-        self.data[key] = self.get(key, 0) + by
-        return self.data[key]
+        with self._lock:
+            self.data[key] = self.get(key, 0) + by
+            self._put(key)
+            return self.data[key]
+
+    def append_to_list(self, key, value, max_items=100):
+        """Append to a bounded list in state; old items fall off the front."""
+        with self._lock:
+            items = self.data.get(key)
+            if not isinstance(items, deque):
+                items = deque(items or [], maxlen=_maxlen_for(key) or max_items)
+                self.data[key] = items
+            items.append(value)
+            self._put(key)
+            return items
+
+
+def create_state_manager(path: Path):
+    """Create the configured state backend (sqlite unless overridden)."""
+    if STATE_BACKEND != 'json':
+        try:
+            return SqliteStateManager(path)
+        except Exception as e:
+            logger.error(f"SQLite state backend unavailable ({e}), using JSON")
+    return JsonStateManager(path)
 
 
 # Global state manager
-state = StateManager(STATE_PATH)
+state = create_state_manager(STATE_PATH)
+
+# Per-thread request body buffer, reused across requests
+_tls = threading.local()
 
 
 class AgentHandler(BaseHTTPRequestHandler):
     """HTTP handler for agent requests."""
 
+    # Keep-alive: one TCP connection serves many webhook calls
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Buffer the socket writer so each response goes out as one write
+        self.wfile = io.BufferedWriter(self.wfile, 8192)
+
+    def _read_body(self, content_length):
+        """Read the request body into a reusable per-thread buffer."""
+        buf = getattr(_tls, 'buf', None)
+        if buf is None or len(buf) < content_length:
+            buf = bytearray(max(content_length, 4096))
+            _tls.buf = buf
+        view = memoryview(buf)[:content_length]
+        read = 0
+        while read < content_length:
+            n = self.rfile.readinto(view[read:])
+            if not n:
+                break
+            read += n
+        return view[:read]
+
     def do_GET(self):
         if self.path == '/health':
-            self.send_json({
-                'status': 'healthy',
-                'agent': AGENT_NAME,
-                'state_keys': len(state.data)
-            })
+            self.send_raw(HEALTH_PREFIX + str(len(state.data)).encode() + b'}')
         else:
             # Track visit count - this persists across sleep/wake!
             count = state.increment('visit_count')
@@ -91,19 +422,17 @@ class AgentHandler(BaseHTTPRequestHandler):
 
     def do_POST(self):
         content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        data = json.loads(body) if body else {}
+        data = _loads(self._read_body(content_length)) if content_length else {}
 
-        # Example: Store messages in state
-        messages = state.get('messages', [])
+        # Example: Store messages in state (bounded, keeps last 100)
         if 'message' in data:
-            messages.append({
+            state.increment('message_count')
+            state.append_to_list('messages', {
                 'text': data['message'],
-                'count': state.increment('message_count')
+                'timestamp': int(time.time())
             })
-            state.set('messages', messages[-100:])  # Keep last 100
 
-        logger.info(f"Received: {data}")
+        logger.info("Received: %r", data)
 
         self.send_json({
             'success': True,
@@ -112,11 +441,21 @@ class AgentHandler(BaseHTTPRequestHandler):
             'note': 'Messages are stored and persist across sleep/wake!'
         })
 
+    def send_raw(self, body, status=200):
+        """Write a pre-encoded JSON body with headers as a single response."""
+        reason = self.responses.get(status, ('', ''))[0]
+        header = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: keep-alive\r\n\r\n"
+        ).encode('latin-1')
+        self.wfile.write(header + body)
+        self.wfile.flush()
+        self.log_request(status)
+
     def send_json(self, data, status=200):
-        self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+        self.send_raw(_dumps(data), status)
 
     def log_message(self, format, *args):
         logger.info(f"{self.address_string()} - {format % args}")
@@ -125,7 +464,7 @@ class AgentHandler(BaseHTTPRequestHandler):
 def shutdown_handler(signum, frame):
     """Handle graceful shutdown - save state before sleeping."""
     logger.info("Shutdown signal received, saving state...")
-    state.save()
+    state.snapshot()
     logger.info("Agent ready to sleep")
     sys.exit(0)
 
@@ -139,6 +478,6 @@ if __name__ == '__main__':
     logger.info(f"State path: {STATE_PATH}")
 
     try:
-        HTTPServer(('0.0.0.0', PORT), AgentHandler).serve_forever()
+        ThreadingHTTPServer(('0.0.0.0', PORT), AgentHandler).serve_forever()
     except KeyboardInterrupt:
         shutdown_handler(None, None)
@@ -2,21 +2,31 @@
 Agentiom Agent: slack-assistant
 
 A stateful agent that remembers data across sleep/wake cycles.
-State is persisted to /data/state.json on the attached volume.
+State is persisted on the attached volume, by default to a SQLite database
+at /data/state.db (set AGENTIOM_STATE_BACKEND=json for the legacy
+log + snapshot files next to /data/state.json).
 
 Supports:
 - HTTP GET/POST for general requests
 - POST /slack for Slack message handling with Claude AI
 """
 
+import io
 import os
 import json
 import logging
+import mmap
+import re
 import signal
+import sqlite3
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from pathlib import Path
-from datetime import datetime
+from itertools import islice
 from urllib.parse import urlparse
 
 # Optional: Anthropic for AI responses
@@ -26,6 +36,33 @@ try:
 except ImportError:
     CLAUDE_AVAILABLE = False
 
+# Optional: uvicorn + starlette for an async server (stdlib fallback below)
+try:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import Response
+    from starlette.routing import Route
+    ASGI_AVAILABLE = True
+except ImportError:
+    ASGI_AVAILABLE = False
+
+# Optional: orjson for faster state (de)serialization (stdlib json fallback)
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, default=str)
+
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, separators=(',', ':'), default=str).encode()
+
+    def _loads(data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return json.loads(data)
+
 logging.basicConfig(
     level=os.getenv('LOG_LEVEL', 'INFO'),
     format='%(asctime)s [%(levelname)s] %(message)s'
@@ -35,77 +72,464 @@ logger = logging.getLogger(__name__)
 AGENT_NAME = os.getenv('AGENTIOM_AGENT_NAME', os.getenv('AGENT_NAME', 'slack-assistant'))
 PORT = int(os.getenv('PORT', '8080'))
 STATE_PATH = Path(os.getenv('AGENTIOM_STATE_PATH', '/data')) / 'state.json'
+STATE_BACKEND = os.getenv('AGENTIOM_STATE_BACKEND', 'sqlite')
+
+# /health is probed constantly; pre-encode everything but the state_keys count
+HEALTH_PREFIX = (
+    '{"status":"healthy","agent":%s,"claude_enabled":%s,"state_keys":'
+    % (json.dumps(AGENT_NAME), 'true' if CLAUDE_AVAILABLE else 'false')
+).encode()
+
+# Matches "my name is X", "i'm X", "i am X", "call me X"
+NAME_RE = re.compile(r"(?:my name is|i'm|i am|call me) ([A-Za-z]+)", re.IGNORECASE)
+
+
+# Keys holding bounded lists (exact key or prefix) and their max lengths
+BOUNDED_LISTS = {'messages': 100, 'slack_history_': 50}
+
+
+def _maxlen_for(key):
+    for prefix, maxlen in BOUNDED_LISTS.items():
+        if key.startswith(prefix):
+            return maxlen
+    return None
+
+# Snapshot the full state after this many logged mutations
+SNAPSHOT_EVERY = 200
+
+# Hint the kernel to start log writeback after this many appended bytes,
+# so dirty pages drain incrementally instead of in one giant flush
+SYNC_RANGE_BYTES = 256 * 1024
+
+# Flush the buffered mutation log after this many mutations or this much time
+FLUSH_EVERY = 16
+FLUSH_INTERVAL = 1.0
+FORCED_FLUSH_INTERVAL = 5.0
+
 
+class JsonStateManager:
+    """Persistent state in a JSON snapshot plus append-only mutation log.
 
-class StateManager:
-    """Persistent state that survives sleep/wake cycles."""
+    Mutations are appended to a JSONL log next to the snapshot file, so each
+    write is O(change) instead of rewriting the whole state. The full state is
+    snapshotted every SNAPSHOT_EVERY mutations and on shutdown, after which
+    the log is truncated. On startup the snapshot is loaded and the log
+    replayed, so nothing is lost between snapshots. Log entries carry a
+    sequence number that the snapshot records, so entries a snapshot already
+    folded in are never re-applied (appends are not idempotent).
+    """
 
     def __init__(self, path: Path):
         self.path = path
+        self.log_path = path.with_suffix('.log')
+        self._lock = threading.RLock()
         self.data = {}
+        self._mutations = 0
+        self._seq = 0
+        self._bytes_since_sync = 0
+        self._dirty = False
+        self._dirty_count = 0
+        self._last_flush = time.monotonic()
         self.load()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._log = open(self.log_path, 'ab', buffering=65536)
 
     def load(self):
-        """Load state from disk."""
+        """Load the last snapshot, then replay any logged mutations."""
         try:
-            if self.path.exists():
-                with open(self.path) as f:
-                    self.data = json.load(f)
+            if self.path.exists() and self.path.stat().st_size:
+                # Map the file and hand the whole buffer to the one-shot
+                # parser: no text decode, no 8 KB incremental reads
+                with open(self.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                    mv = memoryview(mm)
+                    try:
+                        self.data = _loads(mv)
+                    finally:
+                        mv.release()
+                        mm.close()
                 logger.info(f"Loaded state ({len(self.data)} keys)")
             else:
                 logger.info("No existing state, starting fresh")
         except Exception as e:
             logger.error(f"Failed to load state: {e}")
             self.data = {}
+        self._seq = self.data.pop('__seq__', 0)
+        self._replay_log()
+        for key, value in self.data.items():
+            maxlen = _maxlen_for(key)
+            if maxlen and isinstance(value, list):
+                self.data[key] = deque(value, maxlen=maxlen)
+
+    def _replay_log(self):
+        """Apply mutations logged since the last snapshot.
+
+        A crash mid-append leaves a torn final line; that tail is cut off so
+        the log ends on a clean line before it is reopened for appending.
+        """
+        if not self.log_path.exists():
+            return
+        replayed = 0
+        valid_bytes = 0
+        torn = False
+        try:
+            with open(self.log_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        torn = True  # partial final line from a crash mid-append
+                        break
+                    stripped = line.strip()
+                    if stripped:
+                        try:
+                            entry = _loads(stripped)
+                        except ValueError:
+                            torn = True
+                            break
+                        seq = entry.get('s', 0)
+                        # entries at or below the snapshot's sequence number
+                        # are already folded in (crash after the rename but
+                        # before the log truncate); don't re-apply them
+                        if not seq or seq > self._seq:
+                            self._apply(entry)
+                            self._seq = max(self._seq, seq)
+                            replayed += 1
+                    valid_bytes += len(line)
+            if torn:
+                with open(self.log_path, 'r+b') as f:
+                    f.truncate(valid_bytes)
+                logger.warning(f"Dropped torn state log tail after {valid_bytes} bytes")
+        except Exception as e:
+            logger.error(f"Failed to replay state log: {e}")
+        if replayed:
+            logger.info(f"Replayed {replayed} logged mutations")
+
+    def _apply(self, entry):
+        op = entry.get('op')
+        if op == 'append':
+            items = self.data.get(entry['k'], [])
+            items.append(entry['v'])
+            if not isinstance(items, deque):
+                self.data[entry['k']] = items[-entry.get('max', 100):]
+        elif op == 'del':
+            self.data.pop(entry['k'], None)
+        else:
+            self.data[entry['k']] = entry['v']
 
-    def save(self):
-        """Save state to disk."""
+    def _log_mutation(self, entry):
+        self._seq += 1
+        entry['s'] = self._seq
         try:
-            self.path.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.path, 'w') as f:
-                json.dump(self.data, f, indent=2, default=str)
-            logger.info("State saved")
+            line = _dumps(entry) + b'\n'
+            self._log.write(line)
+            self._bytes_since_sync += len(line)
+            if (self._bytes_since_sync >= SYNC_RANGE_BYTES
+                    and hasattr(os, 'sync_file_range')):
+                # Non-blocking writeback hint; the snapshot's durable write
+                # remains the only real barrier
+                self._log.flush()
+                os.sync_file_range(
+                    self._log.fileno(), 0, 0, os.SYNC_FILE_RANGE_WRITE
+                )
+                self._bytes_since_sync = 0
         except Exception as e:
-            logger.error(f"Failed to save state: {e}")
+            logger.error(f"Failed to append to state log: {e}")
+        self._dirty = True
+        self._dirty_count += 1
+        self._mutations += 1
+        if self._mutations >= SNAPSHOT_EVERY:
+            self.snapshot()
+
+    def flush(self):
+        """Force buffered log entries to disk."""
+        with self._lock:
+            try:
+                self._log.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush state log: {e}")
+            self._dirty_count = 0
+            self._last_flush = time.monotonic()
+
+    def maybe_save(self):
+        """Flush the log once enough mutations or time have accumulated.
+
+        Called once per request instead of per mutation, so a burst of writes
+        amortizes to a single flush.
+        """
+        if self._dirty_count >= FLUSH_EVERY or (
+            self._dirty_count and time.monotonic() - self._last_flush > FLUSH_INTERVAL
+        ):
+            self.flush()
+
+    def snapshot(self):
+        """Atomically write the full state to disk and truncate the mutation log.
+
+        Does nothing if no mutation happened since the last snapshot, so clean
+        shutdowns and idle timers cost no fsync. The write goes to a tmp file
+        that is fsynced and renamed over the snapshot, then the directory is
+        fsynced, so a crash at any point leaves a complete snapshot behind.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp = self.path.with_suffix('.tmp')
+                snap = {
+                    k: list(v) if isinstance(v, deque) else v
+                    for k, v in self.data.items()
+                }
+                snap['__seq__'] = self._seq
+                buf = _dumps(snap)
+                if hasattr(os, 'O_DSYNC'):
+                    # O_DSYNC makes write + fdatasync a single submitted operation
+                    fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_DSYNC, 0o644)
+                    try:
+                        os.write(fd, buf)
+                    finally:
+                        os.close(fd)
+                else:
+                    with open(tmp, 'wb', buffering=65536) as f:
+                        f.write(buf)
+                        f.flush()
+                        os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+                dfd = os.open(self.path.parent, os.O_DIRECTORY)
+                try:
+                    os.fsync(dfd)
+                finally:
+                    os.close(dfd)
+                self._log.truncate(0)
+                self._mutations = 0
+                self._bytes_since_sync = 0
+                self._dirty = False
+                self._dirty_count = 0
+                self._last_flush = time.monotonic()
+                logger.info("State snapshot saved")
+            except Exception as e:
+                logger.error(f"Failed to save state: {e}")
 
     def get(self, key, default=None):
         return self.data.get(key, default)
 
     def set(self, key, value):
-        self.data[key] = value
+        with self._lock:
+            self.data[key] = value
+            self._log_mutation({'k': key, 'v': value})
 
     def increment(self, key, by=1):
-        self.data[key] = self.get(key, 0) + by
-        return self.data[key]
+        with self._lock:
+            self.data[key] = self.get(key, 0) + by
+            self._log_mutation({'k': key, 'v': self.data[key]})
+            return self.data[key]
 
     def append_to_list(self, key, value, max_items=100):
-        """Append to a list in state, keeping last N items."""
-        items = self.get(key, [])
-        items.append(value)
-        self.set(key, items[-max_items:])
-        return items
+        """Append to a bounded list in state; old items fall off the front."""
+        with self._lock:
+            items = self.data.get(key)
+            if not isinstance(items, deque):
+                items = deque(items or [], maxlen=_maxlen_for(key) or max_items)
+                self.data[key] = items
+            items.append(value)
+            self._log_mutation({'op': 'append', 'k': key, 'v': value, 'max': max_items})
+            return items
+
+    def delete(self, key):
+        with self._lock:
+            if key in self.data:
+                del self.data[key]
+                self._log_mutation({'op': 'del', 'k': key})
+
+
+class SqliteStateManager:
+    """Persistent state backed by SQLite in WAL mode.
+
+    Each key is one row (key -> JSON blob), so an update writes only the
+    changed row and the WAL amortizes durability instead of an fsync per
+    write. Reads come from an in-memory mirror hydrated by a single table
+    scan at startup. A legacy state.json (and its mutation log) is migrated
+    into the database on first run.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.db_path = path.with_suffix('.db')
+        self._lock = threading.RLock()
+        self.data = {}
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            self.db_path, isolation_level=None, check_same_thread=False
+        )
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS kv (k TEXT PRIMARY KEY, v BLOB)')
+        self.load()
 
+    def load(self):
+        """Hydrate the in-memory mirror, migrating legacy JSON state if present."""
+        rows = self._conn.execute('SELECT k, v FROM kv').fetchall()
+        if rows:
+            self.data = {k: _loads(v) for k, v in rows}
+            logger.info(f"Loaded state ({len(self.data)} keys)")
+        elif self.path.exists() or self.path.with_suffix('.log').exists():
+            legacy = JsonStateManager(self.path)
+            for key, value in legacy.data.items():
+                self.data[key] = value
+                self._put(key)
+            logger.info(f"Migrated {len(self.data)} keys from {self.path}")
+        else:
+            logger.info("No existing state, starting fresh")
+        for key, value in self.data.items():
+            maxlen = _maxlen_for(key)
+            if maxlen and isinstance(value, list):
+                self.data[key] = deque(value, maxlen=maxlen)
+
+    def _put(self, key):
+        value = self.data[key]
+        if isinstance(value, deque):
+            value = list(value)
+        try:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO kv VALUES (?, ?)', (key, _dumps(value))
+            )
+        except Exception as e:
+            logger.error(f"Failed to write state key {key}: {e}")
 
-# Global state manager
-state = StateManager(STATE_PATH)
+    def flush(self):
+        """No-op: each upsert is already committed via the WAL."""
+
+    def maybe_save(self):
+        """No-op: each upsert is already committed via the WAL."""
+
+    def snapshot(self):
+        """Checkpoint the WAL so the main database is self-contained."""
+        with self._lock:
+            try:
+                self._conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            except Exception as e:
+                logger.error(f"Failed to checkpoint state database: {e}")
 
-# Claude client (if available)
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self.data[key] = value
+            self._put(key)
+
+    def increment(self, key, by=1):
+        with self._lock:
+            self.data[key] = self.get(key, 0) + by
+            self._put(key)
+            return self.data[key]
+
+    def append_to_list(self, key, value, max_items=100):
+        """Append to a bounded list in state; old items fall off the front."""
+        with self._lock:
+            items = self.data.get(key)
+            if not isinstance(items, deque):
+                items = deque(items or [], maxlen=_maxlen_for(key) or max_items)
+                self.data[key] = items
+            items.append(value)
+            self._put(key)
+            return items
+
+    def delete(self, key):
+        with self._lock:
+            if key in self.data:
+                del self.data[key]
+                try:
+                    self._conn.execute('DELETE FROM kv WHERE k = ?', (key,))
+                except Exception as e:
+                    logger.error(f"Failed to delete state key {key}: {e}")
+
+
+def create_state_manager(path: Path):
+    """Create the configured state backend (sqlite unless overridden)."""
+    if STATE_BACKEND != 'json':
+        try:
+            return SqliteStateManager(path)
+        except Exception as e:
+            logger.error(f"SQLite state backend unavailable ({e}), using JSON")
+    return JsonStateManager(path)
+
+
+# Global state manager
+state = create_state_manager(STATE_PATH)
+
+# Per-thread request body buffer, reused across requests
+_tls = threading.local()
+
+# Drop per-user Slack state idle for this long, and cap total tracked users
+USER_TTL_DAYS = 30
+MAX_USERS = 10000
+
+
+def evict_stale_users():
+    """Drop Slack users idle past the TTL and enforce the global user cap.
+
+    Runs at startup so len(state.data) - and with it snapshot size and load
+    time - stays bounded no matter how many users ever talked to the agent.
+    Users from before last-seen tracking get their clock started now instead
+    of being evicted.
+    """
+    now = int(time.time())
+    cutoff = now - USER_TTL_DAYS * 86400
+    users = {}
+    for key in state.data:
+        for prefix in ('slack_history_', 'slack_user_'):
+            if key.startswith(prefix):
+                users.setdefault(key[len(prefix):], []).append(key)
+    if not users:
+        return
+    last_seen = {uid: state.get(f'slack_seen_{uid}') for uid in users}
+    oldest_first = sorted(users, key=lambda uid: last_seen[uid] or now)
+    evicted = 0
+    for rank, uid in enumerate(oldest_first):
+        seen = last_seen[uid]
+        if seen is None:
+            state.set(f'slack_seen_{uid}', now)
+            continue
+        if seen < cutoff or len(oldest_first) - rank > MAX_USERS:
+            for key in users[uid] + [f'slack_seen_{uid}']:
+                state.delete(key)
+            evicted += 1
+    if evicted:
+        logger.info(f"Evicted state for {evicted} stale Slack users")
+
+# Claude clients (if available); the async one lets the ASGI server keep
+# many Slack turns in flight on a single worker
 claude = anthropic.Anthropic() if CLAUDE_AVAILABLE else None
+claude_async = anthropic.AsyncAnthropic() if CLAUDE_AVAILABLE else None
 
+# In-process cache of per-user info: user_id -> (cached_at, user_info)
+USER_CACHE_TTL = 600.0
+_user_cache = {}
 
-def get_slack_response(message: str, user_id: str, channel_id: str) -> str:
-    """Generate a response to a Slack message using Claude with persistent memory."""
 
-    if not claude:
-        return f"AI not configured. Your message: {message}"
+def get_user_info(user_id: str) -> dict:
+    """Return saved info for a Slack user, cached in-process for 10 minutes."""
+    cached = _user_cache.get(user_id)
+    if cached and time.monotonic() - cached[0] < USER_CACHE_TTL:
+        return cached[1]
+    user_info = state.get(f"slack_user_{user_id}", {})
+    _user_cache[user_id] = (time.monotonic(), user_info)
+    return user_info
+
 
-    # Get conversation history for this user
-    history_key = f"slack_history_{user_id}"
-    conversation = state.get(history_key, [])
+# Rendered system prompts: user_id -> (user_info fingerprint, prompt)
+_system_prompt_cache = {}
 
-    # Get user info from state
-    user_key = f"slack_user_{user_id}"
-    user_info = state.get(user_key, {})
+
+def get_system_prompt(user_id: str, user_info: dict) -> str:
+    """Render the system prompt for a user, reused while user_info is unchanged.
+
+    Keeping the prompt byte-identical across turns also lets Anthropic's
+    prompt caching apply to it.
+    """
+    fingerprint = hash(tuple(sorted((k, str(v)) for k, v in user_info.items())))
+    cached = _system_prompt_cache.get(user_id)
+    if cached and cached[0] == fingerprint:
+        return cached[1]
 
     # Build context from persistent state
     context_parts = []
@@ -116,7 +540,6 @@ def get_slack_response(message: str, user_id: str, channel_id: str) -> str:
     if user_info.get('notes'):
         context_parts.append(f"Notes about user: {user_info['notes']}")
 
-    # Build system prompt with persistent context
     system_prompt = f"""You are a helpful AI assistant with persistent memory. You are part of Agentiom, a platform for AI agents.
 
 Your name is {AGENT_NAME}.
@@ -131,18 +554,68 @@ Key traits:
 - If a user tells you their name or preferences, acknowledge that you'll remember it
 
 When a user shares personal information like their name, respond naturally and remember it for future conversations."""
+    _system_prompt_cache[user_id] = (fingerprint, system_prompt)
+    return system_prompt
+
+
+def build_claude_request(message: str, user_id: str):
+    """Assemble the (system prompt, messages) pair for one Slack turn."""
+
+    # Conversation history for this user (a deque(maxlen=50) held in state)
+    conversation = state.get(f"slack_history_{user_id}") or ()
+
+    # Get user info from state (warm hits skip the state dict entirely)
+    user_info = get_user_info(user_id)
+
+    # System prompt with persistent context (cached until user_info changes)
+    system_prompt = get_system_prompt(user_id, user_info)
 
     # Build messages from history
     messages = []
-    for entry in conversation[-10:]:  # Last 10 exchanges
+    start = max(0, len(conversation) - 10)
+    for entry in islice(conversation, start, None):  # Last 10 exchanges
         messages.append({"role": "user", "content": entry["user"]})
         messages.append({"role": "assistant", "content": entry["assistant"]})
 
     # Add current message
     messages.append({"role": "user", "content": message})
 
+    return system_prompt, messages, user_info
+
+
+def record_slack_exchange(message: str, reply: str, user_id: str, user_info: dict):
+    """Persist one exchange and any user info the message revealed."""
+
+    state.set(f"slack_seen_{user_id}", int(time.time()))
+
+    # Save conversation to state (deque drops exchanges beyond 50)
+    state.append_to_list(f"slack_history_{user_id}", {
+        "user": message,
+        "assistant": reply,
+        "timestamp": int(time.time())
+    }, max_items=50)
+
+    # Extract and save user info if mentioned
+    match = NAME_RE.search(message)
+    if match:
+        name = match.group(1).capitalize()
+        user_info['name'] = name
+        user_info['name_set_at'] = int(time.time())
+        state.set(f"slack_user_{user_id}", user_info)
+        _user_cache[user_id] = (time.monotonic(), user_info)
+        logger.info(f"Saved user name: {name}")
+
+
+def get_slack_response(message: str, user_id: str, channel_id: str) -> str:
+    """Generate a response to a Slack message using Claude with persistent memory."""
+
+    if not claude:
+        return f"AI not configured. Your message: {message}"
+
+    system_prompt, messages, user_info = build_claude_request(message, user_id)
+
     try:
-        logger.info(f"Sending to Claude: {message[:100]}...")
+        logger.info("Sending to Claude: %.100s...", message)
 
         response = claude.messages.create(
             model="claude-sonnet-4-20250514",
@@ -152,39 +625,43 @@ When a user shares personal information like their name, respond naturally and r
         )
 
         reply = response.content[0].text
-        logger.info(f"Claude response: {reply[:100]}...")
-
-        # Save conversation to state
-        conversation.append({
-            "user": message,
-            "assistant": reply,
-            "timestamp": datetime.now().isoformat()
-        })
-        state.set(history_key, conversation[-50:])  # Keep last 50 exchanges
-
-        # Extract and save user info if mentioned
-        message_lower = message.lower()
-        if "my name is" in message_lower or "i'm " in message_lower or "i am " in message_lower:
-            # Simple name extraction
-            import re
-            patterns = [
-                r"my name is ([A-Za-z]+)",
-                r"i'm ([A-Za-z]+)",
-                r"i am ([A-Za-z]+)",
-                r"call me ([A-Za-z]+)"
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, message_lower)
-                if match:
-                    name = match.group(1).capitalize()
-                    user_info['name'] = name
-                    user_info['name_set_at'] = datetime.now().isoformat()
-                    state.set(user_key, user_info)
-                    logger.info(f"Saved user name: {name}")
-                    break
-
-        # Save state after each interaction
-        state.save()
+        logger.info("Claude response: %.100s...", reply)
+
+        record_slack_exchange(message, reply, user_id, user_info)
+
+        return reply
+
+    except Exception as e:
+        logger.error(f"Claude error: {e}")
+        return f"Sorry, I encountered an error. Please try again."
+
+
+async def get_slack_response_async(message: str, user_id: str, channel_id: str) -> str:
+    """Async variant of get_slack_response for the ASGI server.
+
+    Awaiting the Claude call means one worker can have many Slack turns in
+    flight instead of one thread blocked per turn.
+    """
+
+    if not claude_async:
+        return f"AI not configured. Your message: {message}"
+
+    system_prompt, messages, user_info = build_claude_request(message, user_id)
+
+    try:
+        logger.info("Sending to Claude: %.100s...", message)
+
+        response = await claude_async.messages.create(
+            model="claude-sonnet-4-20250514",
+            max_tokens=1024,
+            system=system_prompt,
+            messages=messages
+        )
+
+        reply = response.content[0].text
+        logger.info("Claude response: %.100s...", reply)
+
+        record_slack_exchange(message, reply, user_id, user_info)
 
         return reply
 
@@ -196,16 +673,34 @@ When a user shares personal information like their name, respond naturally and r
 class AgentHandler(BaseHTTPRequestHandler):
     """HTTP handler for agent requests."""
 
+    # Keep-alive: one TCP connection serves many webhook calls
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        # Buffer the socket writer so each response goes out as one write
+        self.wfile = io.BufferedWriter(self.wfile, 8192)
+
+    def _read_body(self, content_length):
+        """Read the request body into a reusable per-thread buffer."""
+        buf = getattr(_tls, 'buf', None)
+        if buf is None or len(buf) < content_length:
+            buf = bytearray(max(content_length, 4096))
+            _tls.buf = buf
+        view = memoryview(buf)[:content_length]
+        read = 0
+        while read < content_length:
+            n = self.rfile.readinto(view[read:])
+            if not n:
+                break
+            read += n
+        return view[:read]
+
     def do_GET(self):
         path = urlparse(self.path).path
 
         if path == '/health':
-            self.send_json({
-                'status': 'healthy',
-                'agent': AGENT_NAME,
-                'claude_enabled': CLAUDE_AVAILABLE,
-                'state_keys': len(state.data)
-            })
+            self.send_raw(HEALTH_PREFIX + str(len(state.data)).encode() + b'}')
         else:
             # Track visit count - this persists across sleep/wake!
             count = state.increment('visit_count')
@@ -217,63 +712,165 @@ class AgentHandler(BaseHTTPRequestHandler):
             })
 
     def do_POST(self):
-        path = urlparse(self.path).path
-        content_length = int(self.headers.get('Content-Length', 0))
-        body = self.rfile.read(content_length)
-        data = json.loads(body) if body else {}
+        try:
+            path = urlparse(self.path).path
+            content_length = int(self.headers.get('Content-Length', 0))
+            data = _loads(self._read_body(content_length)) if content_length else {}
 
-        logger.info(f"POST {path}: {json.dumps(data)[:200]}")
+            logger.info("POST %s: %.200s", path, data)
+
+            # Handle Slack messages
+            if path == '/slack':
+                message = data.get('message', '')
+                user_id = data.get('userId', 'unknown')
+                channel_id = data.get('channelId', '')
+
+                if not message:
+                    self.send_json({'error': 'No message provided'}, 400)
+                    return
+
+                response_text = get_slack_response(message, user_id, channel_id)
+
+                self.send_json({
+                    'text': response_text,
+                    'agent': AGENT_NAME
+                })
+                return
+
+            # Default POST handler - store messages (bounded, keeps last 100)
+            if 'message' in data:
+                state.increment('message_count')
+                state.append_to_list('messages', {
+                    'text': data['message'],
+                    'timestamp': int(time.time())
+                })
+
+            self.send_json({
+                'success': True,
+                'received': data,
+                'total_messages': state.get('message_count', 0),
+                'note': 'Messages are stored and persist across sleep/wake!'
+            })
+        finally:
+            # One flush per request at most, not one per mutation
+            state.maybe_save()
+
+    def send_raw(self, body, status=200):
+        """Write a pre-encoded JSON body with headers as a single response."""
+        reason = self.responses.get(status, ('', ''))[0]
+        header = (
+            f"HTTP/1.1 {status} {reason}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: keep-alive\r\n\r\n"
+        ).encode('latin-1')
+        self.wfile.write(header + body)
+        self.wfile.flush()
+        self.log_request(status)
+
+    def send_json(self, data, status=200):
+        self.send_raw(_dumps(data), status)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+
+def build_asgi_app():
+    """Build the Starlette app mirroring the stdlib handler's routes."""
+
+    def json_response(data, status=200):
+        return Response(_dumps(data), status_code=status, media_type='application/json')
+
+    async def health(request):
+        return Response(
+            HEALTH_PREFIX + str(len(state.data)).encode() + b'}',
+            media_type='application/json'
+        )
+
+    async def slack(request):
+        try:
+            body = await request.body()
+            data = _loads(body) if body else {}
+
+            logger.info("POST /slack: %.200s", data)
 
-        # Handle Slack messages
-        if path == '/slack':
             message = data.get('message', '')
             user_id = data.get('userId', 'unknown')
             channel_id = data.get('channelId', '')
 
             if not message:
-                self.send_json({'error': 'No message provided'}, 400)
-                return
+                return json_response({'error': 'No message provided'}, 400)
 
-            response_text = get_slack_response(message, user_id, channel_id)
+            response_text = await get_slack_response_async(message, user_id, channel_id)
 
-            self.send_json({
+            return json_response({
                 'text': response_text,
                 'agent': AGENT_NAME
             })
-            return
+        finally:
+            state.maybe_save()
 
-        # Default POST handler - store messages
-        messages = state.get('messages', [])
-        if 'message' in data:
-            messages.append({
-                'text': data['message'],
-                'count': state.increment('message_count'),
-                'timestamp': datetime.now().isoformat()
+    async def fallback(request):
+        if request.method == 'GET':
+            # Track visit count - this persists across sleep/wake!
+            count = state.increment('visit_count')
+            return json_response({
+                'message': f'Hello from {AGENT_NAME}!',
+                'visit_count': count,
+                'claude_enabled': CLAUDE_AVAILABLE,
+                'note': 'This count persists even when the agent sleeps!'
             })
-            state.set('messages', messages[-100:])
-            state.save()
+        try:
+            body = await request.body()
+            data = _loads(body) if body else {}
+
+            logger.info("POST %s: %.200s", request.url.path, data)
+
+            # Default POST handler - store messages (bounded, keeps last 100)
+            if 'message' in data:
+                state.increment('message_count')
+                state.append_to_list('messages', {
+                    'text': data['message'],
+                    'timestamp': int(time.time())
+                })
+
+            return json_response({
+                'success': True,
+                'received': data,
+                'total_messages': state.get('message_count', 0),
+                'note': 'Messages are stored and persist across sleep/wake!'
+            })
+        finally:
+            state.maybe_save()
 
-        self.send_json({
-            'success': True,
-            'received': data,
-            'total_messages': state.get('message_count', 0),
-            'note': 'Messages are stored and persist across sleep/wake!'
-        })
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        # Mirror the stdlib server's shutdown handler: snapshot before sleep
+        state.snapshot()
 
-    def send_json(self, data, status=200):
-        self.send_response(status)
-        self.send_header('Content-Type', 'application/json')
-        self.end_headers()
-        self.wfile.write(json.dumps(data).encode())
+    return Starlette(
+        routes=[
+            Route('/health', health, methods=['GET']),
+            Route('/slack', slack, methods=['POST']),
+            Route('/{rest:path}', fallback, methods=['GET', 'POST']),
+        ],
+        lifespan=lifespan,
+    )
 
-    def log_message(self, format, *args):
-        logger.info(f"{self.address_string()} - {format % args}")
+
+def periodic_flush():
+    """Force buffered mutations to disk every few seconds, even when idle."""
+    state.flush()
+    timer = threading.Timer(FORCED_FLUSH_INTERVAL, periodic_flush)
+    timer.daemon = True
+    timer.start()
 
 
 def shutdown_handler(signum, frame):
     """Handle graceful shutdown - save state before sleeping."""
     logger.info("Shutdown signal received, saving state...")
-    state.save()
+    state.snapshot()
     logger.info("Agent ready to sleep")
     sys.exit(0)
 
@@ -287,7 +884,14 @@ if __name__ == '__main__':
     logger.info(f"State path: {STATE_PATH}")
     logger.info(f"Claude AI: {'Enabled' if CLAUDE_AVAILABLE else 'Disabled (no API key)'}")
 
-    try:
-        HTTPServer(('0.0.0.0', PORT), AgentHandler).serve_forever()
-    except KeyboardInterrupt:
-        shutdown_handler(None, None)
+    evict_stale_users()
+    periodic_flush()
+
+    if ASGI_AVAILABLE:
+        # Async server: Claude calls await instead of holding a thread each
+        uvicorn.run(build_asgi_app(), host='0.0.0.0', port=PORT, log_level='warning')
+    else:
+        try:
+            ThreadingHTTPServer(('0.0.0.0', PORT), AgentHandler).serve_forever()
+        except KeyboardInterrupt:
+            shutdown_handler(None, None)